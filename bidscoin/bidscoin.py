@@ -61,26 +61,12 @@ class TqdmUpTo(tqdm):
         self.update(b * bsize - self.n)  # will also set self.n = b * bsize
 
 
-def setup_logging(logfile: Path=Path()):
+def setup_loglevels():
     """
-    Setup the logging framework
+    Adds the custom BIDScoin logging levels (BCDEBUG, VERBOSE and SUCCESS) and their Logger methods, e.g. LOGGER.verbose()
 
-    :param logfile:     Name of the logfile
     :return:
-     """
-
-    # Get the BIDSCOIN_DEBUG environment variable to set the log-messages and logging level
-    debug = os.environ.get('BIDSCOIN_DEBUG')
-    debug = True if debug and debug.upper() not in ('0', 'FALSE', 'N', 'NO', 'NONE') else False
-
-    # Set the default formats
-    if debug:
-        fmt  = '%(asctime)s - %(name)s - %(levelname)s | %(message)s'
-        cfmt = '%(levelname)s - %(name)s | %(message)s'
-    else:
-        fmt  = '%(asctime)s - %(levelname)s | %(message)s'
-        cfmt = '%(levelname)s | %(message)s'
-    datefmt  = '%Y-%m-%d %H:%M:%S'
+    """
 
     # Add a BIDScoin debug logging level = 11 (NB: using the standard debug mode will generate may debug messages from imports)
     logging.BCDEBUG = 11
@@ -106,6 +92,31 @@ def setup_logging(logfile: Path=Path()):
         if self.isEnabledFor(logging.SUCCESS): self._log(logging.SUCCESS, message, args, **kws)
     logging.Logger.success = success
 
+
+def setup_logging(logfile: Path=Path()):
+    """
+    Setup the logging framework
+
+    :param logfile:     Name of the logfile
+    :return:
+     """
+
+    # Get the BIDSCOIN_DEBUG environment variable to set the log-messages and logging level
+    debug = os.environ.get('BIDSCOIN_DEBUG')
+    debug = True if debug and debug.upper() not in ('0', 'FALSE', 'N', 'NO', 'NONE') else False
+
+    # Set the default formats
+    if debug:
+        fmt  = '%(asctime)s - %(name)s - %(levelname)s | %(message)s'
+        cfmt = '%(levelname)s - %(name)s | %(message)s'
+    else:
+        fmt  = '%(asctime)s - %(levelname)s | %(message)s'
+        cfmt = '%(levelname)s | %(message)s'
+    datefmt  = '%Y-%m-%d %H:%M:%S'
+
+    # Add the custom BIDScoin logging levels
+    setup_loglevels()
+
     # Set the root logging level
     logger = logging.getLogger()
     logger.setLevel('BCDEBUG' if debug else 'VERBOSE')
@@ -4,12 +4,24 @@ Sorts and / or renames DICOM files into local subfolders, e.g. with 3-digit Seri
 folder names (i.e. following the same listing as on the scanner console)
 """
 
+import os
 import re
+import sys
+import errno
+import glob
 import logging
 import pydicom
 import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import ExitStack, closing
+from functools import lru_cache, partial
+from itertools import chain, islice, tee
+from pydicom import Dataset, datadict
+from pydicom.filereader import read_partial
+from pydicom.tag import Tag, BaseTag
 from pathlib import Path
-from typing import List
+from typing import Any, Callable, Iterable, Iterator, List, Tuple, Union
 try:
     from bidscoin import bidscoin, bids
 except ImportError:
@@ -17,26 +29,113 @@ except ImportError:
 
 LOGGER = logging.getLogger(__name__)
 
+PATTERN   = re.compile(r'.*\.(IMA|dcm)$')                                  # The default regular expression pattern to select the dicom files
+CHUNKSIZE = 64                                                              # The number of dicomfiles that are sent in one go to a worker process
+WORKERS   = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count() or 1     # The number of worker processes (i.e. of the CPUs that this process may use)
+THREADS   = 16                                                              # The number of threads for listing the (e.g. network) session folders
+PIXELDATA = Tag('PixelData')                                                # The DICOM tag at which reading the DICOM fields always stops
+MAXDIRFDS = 32                                                              # The maximum number of open (cached) folder descriptors
+DIRFDS    = os.rename in os.supports_dir_fd and hasattr(os, 'O_DIRECTORY')  # Support for moving files relative to folder descriptors (NB: os.replace() shares the os.rename() implementation)
+if sys.platform == 'win32':
+    WORKERS = min(WORKERS, 61)                                              # ProcessPoolExecutor() raises a ValueError for more than 61 worker processes on Windows
 
-def construct_name(scheme: str, dicomfile: Path) -> str:
+
+# Translation table that removes the worst offending characters from file- and folder-names (but there are many more)
+CLEANUP_TABLE = str.maketrans('', '', '/\\*?"')
+
+# Alternative field names based on earlier DICOM versions or on other reasons
+ALTERNATIVES = {'PatientName':'PatientsName', 'SeriesDescription':'ProtocolName', 'InstanceNumber':'ImageNumber',
+                'PatientsName':'PatientName', 'ProtocolName':'SeriesDescription', 'ImageNumber':'InstanceNumber'}
+
+
+@lru_cache()
+def schemefields(scheme: str) -> Tuple[str, ...]:
+    """
+    Parse the naming scheme string and return the DICOM field names in it. The result is cached, because the same
+    schemes are parsed for every DICOM file
+
+    :param scheme:  The renaming scheme
+    :return:        The DICOM field names in the naming scheme
+    """
+
+    return tuple(re.findall('(?<={)([a-zA-Z]+)(?::\\d+d)?(?=})', scheme)) if scheme else ()
+
+
+@lru_cache()
+def schemetags(fields: Tuple[str, ...]) -> List[BaseTag]:
+    """
+    Gets the (numerical) DICOM tags of the DICOM fields and of their alternatives
+
+    :param fields:  The DICOM field names, e.g. from schemefields()
+    :return:        The sorted list of DICOM tags
+    """
+
+    keywords = set(fields) | {ALTERNATIVES[field] for field in fields if field in ALTERNATIVES}
+
+    return sorted({Tag(tag) for tag in map(datadict.tag_for_keyword, keywords) if tag is not None})
+
+
+def read_dicomfields(dicomfile: Path, tags: List[BaseTag]) -> Union[Dataset, None]:
+    """
+    Reads the DICOM tags from the DICOM file in one go, i.e. without reading the other fields and the pixel data. Since
+    the (top-level) data elements are stored in ascending tag order, parsing stops as soon as the last tag has been read
+
+    :param dicomfile:   The DICOM file that should be read
+    :param tags:        The sorted DICOM tags that should be read, e.g. from schemetags()
+    :return:            The DICOM dataset with the DICOM fields or None if the DICOM file could not be read
+    """
+
+    stoptag = min(tags[-1] + 1, PIXELDATA)
+    try:
+        with dicomfile.open('rb') as fid:
+            return read_partial(fid, stop_when=lambda tag, vr, length: tag >= stoptag, force=True, specific_tags=tags)
+    except Exception as dicomerror:
+        LOGGER.debug(f"Could not read {tags} from {dicomfile}\n{dicomerror}")
+        return None
+
+
+def get_dicomvalue(field: str, dicomfile: Path, dicomdata: Dataset=None) -> Union[str, int]:
+    """
+    Gets the DICOM field value from the DICOM dataset, or robustly from the DICOM file if the value is not in the dataset
+
+    :param field:       The DICOM field name
+    :param dicomfile:   The DICOM file from which the dataset was read
+    :param dicomdata:   The (partial) DICOM dataset, e.g. from read_dicomfields()
+    :return:            The DICOM field value
+    """
+
+    value = dicomdata.get(field) if dicomdata is not None else None
+    if value is None or value == '':
+        return bids.get_dicomfield(field, dicomfile)
+    elif isinstance(value, int):
+        return int(value)
+    else:
+        return str(value)               # If it's a MultiValue type then flatten it
+
+
+def construct_name(scheme: str, dicomfile: Path, dicomdata: Dataset=None, fieldvalues: dict=None) -> str:
     """
     Check the renaming scheme for presence in the DICOM file and use an alternative if available. Then construct the new
     name by replacing the DICOM keys for their values, and applying the formatted string
 
     :param scheme:      The renaming scheme
     :param dicomfile:   The DICOM file that should be renamed
+    :param dicomdata:   The (partial) DICOM dataset of the DICOM file, e.g. from read_dicomfields()
+    :param fieldvalues: Optional cache of the cleaned-up field values of the DICOM file, e.g. to share them between the folder- and namescheme
     :return:            The new name constructed from the scheme
     """
 
-    # Alternative field names based on earlier DICOM versions or on other reasons
-    alternatives = {'PatientName':'PatientsName', 'SeriesDescription':'ProtocolName', 'InstanceNumber':'ImageNumber',
-                    'PatientsName':'PatientName', 'ProtocolName':'SeriesDescription', 'ImageNumber':'InstanceNumber'}
+    if fieldvalues is None:
+        fieldvalues = {}
 
     schemevalues = {}
-    for field in re.findall('(?<={)([a-zA-Z]+)(?::\\d+d)?(?=})', scheme):
-        value = cleanup(bids.get_dicomfield(field, dicomfile))
-        if not value and value != 0 and field in alternatives.keys():
-            value = cleanup(bids.get_dicomfield(alternatives[field], dicomfile))
+    for field in schemefields(scheme):
+        if field in fieldvalues:
+            value = fieldvalues[field]
+        else:
+            value = fieldvalues[field] = cleanup(get_dicomvalue(field, dicomfile, dicomdata))
+            if not value and value != 0 and field in ALTERNATIVES.keys():
+                value = fieldvalues[field] = cleanup(get_dicomvalue(ALTERNATIVES[field], dicomfile, dicomdata))
         if not value and value != 0:
             LOGGER.warning(f"Missing '{field}' DICOM field specified in the '{scheme}' naming scheme, cannot find a safe name for: {dicomfile}\n")
             return ''
@@ -54,7 +153,7 @@ def validscheme(scheme: str) -> bool:
     :return:
     """
 
-    if not re.fullmatch('(({[a-zA-Z]+(:\\d+d)?})|([a-zA-Z0-9\-_.]+))*', scheme):
+    if not re.fullmatch(r'(({[a-zA-Z]+(:\d+d)?})|([a-zA-Z0-9\-_.]+))*', scheme):
         LOGGER.error(f"Bad naming scheme: {scheme}. Only alphanumeric characters could be used for the field names (with the optional number of digits afterwards,"
                       "e.g. '{InstanceNumber:05d}'), and only alphanumeric characters, dots, and dashes + underscores could be used as separators.")
         return False
@@ -70,72 +169,305 @@ def cleanup(name: str) -> str:
     :return:     The cleaned file- or folder-name
     """
 
-    special_characters = ('/', '\\', '*', '?', '"')        # These are the worst offenders, but there are many more
-    for special in special_characters:
-        if isinstance(name, str):
-            name = name.strip().replace(special, '')
+    if isinstance(name, str):
+        name = name.translate(CLEANUP_TABLE).strip()
 
     return name
 
 
-def sortsession(sessionfolder: Path, dicomfiles: List[Path], folderscheme: str, namescheme: str, dryrun: bool) -> None:
+def construct_names(dicomfile: Path, folderscheme: str, namescheme: str, tags: List[BaseTag]) -> Union[Tuple[str, str], None]:
+    """
+    Reads the DICOM fields of the naming schemes from the DICOM file and constructs the new subfolder and file names.
+    NB: This function is executed in parallel worker processes, so it should not depend on any (shared) state
+
+    :param dicomfile:       The DICOM file that should be sorted and/or renamed
+    :param folderscheme:    Optional naming scheme for the sorted (e.g. Series) subfolders
+    :param namescheme:      Optional naming scheme for renaming the files
+    :param tags:            The DICOM tags of the naming schemes, e.g. from schemetags()
+    :return:                The new subfolder and file names ('' if they could not be constructed), or None if the DICOM file does not exist
+    """
+
+    # Check if the DICOM file exists (e.g. in case of DICOMDIRs this may not be the case)
+    if not dicomfile.is_file():
+        return None
+
+    # Read all the DICOM fields of the naming schemes at once
+    dicomdata = read_dicomfields(dicomfile, tags) if tags else None
+
+    fieldvalues = {}
+    subfolder   = construct_name(folderscheme, dicomfile, dicomdata, fieldvalues) if folderscheme else ''
+    filename    = construct_name(namescheme, dicomfile, dicomdata, fieldvalues)   if namescheme   else dicomfile.name
+
+    return subfolder, filename
+
+
+def movefile(dicomfile: Path, newfilename: Path, dirfds: OrderedDict) -> None:
+    """
+    Moves/renames the dicomfile. If supported by the platform, the file is moved relative to (cached) descriptors of its
+    source and destination folders, so that the full pathnames do not need to be resolved for every file. Only the
+    MAXDIRFDS most recently used descriptors are kept open
+
+    :param dicomfile:   The dicomfile that is moved
+    :param newfilename: The new pathname of the dicomfile
+    :param dirfds:      The cache of open folder descriptors. NB: The caller is responsible for closing them
+    :return:            Nothing
+    """
+
+    if not DIRFDS:
+        dicomfile.replace(newfilename)
+        return
+
+    sourcefolder, targetfolder = dicomfile.parent, newfilename.parent
+    try:
+        for folder in (sourcefolder, targetfolder):
+            if folder in dirfds:
+                dirfds.move_to_end(folder)
+            else:
+                dirfds[folder] = os.open(folder, os.O_RDONLY | os.O_DIRECTORY)
+    except OSError as oserror:
+        if oserror.errno != errno.EMFILE:
+            raise
+        dicomfile.replace(newfilename)          # Fall back to moving by pathname if we run out of file descriptors
+        return
+    os.replace(dicomfile.name, newfilename.name, src_dir_fd=dirfds[sourcefolder], dst_dir_fd=dirfds[targetfolder])
+
+    # Close the least recently used folder descriptors
+    while len(dirfds) > MAXDIRFDS:
+        os.close(dirfds.popitem(last=False)[1])
+
+
+class LogBuffer(logging.Handler):
+    """Collects the log records of a worker process, such that they can be logged in the main process"""
+
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record: logging.LogRecord):
+        record.msg      = self.format(record)       # Make the record picklable
+        record.args     = None
+        record.exc_info = None
+        self.records.append(record)
+
+
+_LOGBUFFER = LogBuffer()
+
+
+def initworker(level: int) -> None:
+    """
+    Initializes the logging of a worker process. The log records are not emitted by the worker process itself (that
+    would bypass the bidscoin log files on platforms that spawn new processes), but are buffered and returned by
+    mapchunk() to the main process. The custom BIDScoin logging levels are added as well, because spawned worker processes
+    do not inherit them from the main process
+
+    :param level:   The logging level of the main process
+    :return:        Nothing
+    """
+
+    bidscoin.setup_loglevels()
+    rootlogger = logging.getLogger()
+    for logger in [rootlogger] + [logger for logger in logging.Logger.manager.loggerDict.values() if isinstance(logger, logging.Logger)]:
+        for handler in logger.handlers[:]:
+            logger.removeHandler(handler)
+        logger.propagate = True
+    rootlogger.addHandler(_LOGBUFFER)
+    rootlogger.setLevel(level)
+
+
+def mapchunk(function: Callable, chunk: List) -> List[Tuple[Any, List[logging.LogRecord]]]:
+    """
+    Applies the function to all items in the chunk (in a worker process)
+
+    :param function:    The function that is applied
+    :param chunk:       The list of items
+    :return:            The list of function results, together with the log records that were generated for them
+    """
+
+    results = []
+    for item in chunk:
+        results.append((function(item), _LOGBUFFER.records))
+        _LOGBUFFER.records = []
+
+    return results
+
+
+def chunkresults(future: Future) -> Iterator:
+    """
+    Yields the function results of a mapchunk() future, after logging their log records in the main process
+
+    :param future:  The future of a mapchunk() call
+    :return:        The function results
+    """
+
+    for result, records in future.result():
+        for record in records:
+            logging.getLogger(record.name).handle(record)
+        yield result
+
+
+def lazymap(executor: Executor, function: Callable, iterable: Iterable) -> Iterator:
+    """
+    A lazy alternative to executor.map(): Instead of submitting all work at once, chunks of work are only submitted
+    when there are less than 2 chunks per worker process pending. This keeps the memory use flat and allows the
+    caller to already process the first results while the rest of the iterable is still being generated
+
+    :param executor:    The executor with WORKERS worker processes
+    :param function:    The function that is applied to all items of the iterable
+    :param iterable:    The items that are sent in chunks of CHUNKSIZE to the worker processes
+    :return:            The function results (in the same order as the items). NB: Close the generator when stopping early
+    """
+
+    iterable = iter(iterable)
+    futures  = deque()
+    try:
+        for chunk in iter(lambda: list(islice(iterable, CHUNKSIZE)), []):
+            futures.append(executor.submit(mapchunk, function, chunk))
+            if len(futures) >= 2 * WORKERS:
+                yield from chunkresults(futures.popleft())
+        while futures:
+            yield from chunkresults(futures.popleft())
+
+    # Cancel the pending work if the caller stopped early, i.e. closed the generator (e.g. to abort)
+    finally:
+        for future in futures:
+            future.cancel()
+
+
+def sortsession(sessionfolder: Path, dicomfiles: Iterable[Path], folderscheme: str, namescheme: str, dryrun: bool) -> None:
     """
     Sorts dicomfiles into subfolders (e.g. a 3-digit SeriesNumber-SeriesDescription subfolder, such as '003-T1MPRAGE')
 
     :param sessionfolder:   The name of the destination folder of the dicom files
-    :param dicomfiles:      The list of dicomfiles to be sorted and/or renamed
+    :param dicomfiles:      The (list or generator of) dicomfiles to be sorted and/or renamed
     :param folderscheme:    Optional naming scheme for the sorted (e.g. Series) subfolders. Follows the Python string formatting syntax with DICOM field names in curly bracers with an optional number of digits for numeric fields, e.g. {SeriesNumber:03d}-{SeriesDescription}
     :param namescheme:      Optional naming scheme for renaming the files. Follows the Python string formatting syntax with DICOM field names in curly bracers, e.g. {PatientName}_{SeriesNumber:03d}_{SeriesDescription}_{AcquisitionNumber:05d}_{InstanceNumber:05d}.IMA
     :param dryrun:          Boolean to just display the action
     :return:                Nothing
     """
 
-    LOGGER.info(f">> Sorting: {sessionfolder} ({len(dicomfiles)} files)")
+    LOGGER.info(f">> Sorting: {sessionfolder}")
     if not dryrun:
         sessionfolder.mkdir(parents=True, exist_ok=True)
 
-    # Sort the dicomfiles in (e.g. DICOM Series) subfolders
-    subfolders = []
-    for dicomfile in dicomfiles:
+    # Without naming schemes no DICOM fields are needed and the dicomfiles only need to be moved into the sessionfolder
+    if not (folderscheme or namescheme):
+        dicomfiles = (dicomfile for dicomfile in dicomfiles if dicomfile.parent != sessionfolder)
+
+    # Peek at the first dicomfiles to see if there is enough work for parallel worker processes
+    dicomfiles = iter(dicomfiles)
+    firstfiles = list(islice(dicomfiles, CHUNKSIZE + 1))
+    dicomfiles, dicomfiles_ = tee(chain(firstfiles, dicomfiles))
+
+    # Construct the new names of the dicomfiles, in parallel worker processes if there is enough work
+    tags     = schemetags(schemefields(folderscheme) + schemefields(namescheme))
+    getnames = partial(construct_names, folderscheme=folderscheme, namescheme=namescheme, tags=tags)
+    dirfds   = OrderedDict()
+    with ExitStack() as stack:
+        stack.callback(lambda: [os.close(dirfd) for dirfd in dirfds.values()])
+        if tags and len(firstfiles) > CHUNKSIZE:
+            executor = stack.enter_context(ProcessPoolExecutor(WORKERS, initializer=initworker, initargs=(logging.getLogger().getEffectiveLevel(),)))
+            names    = stack.enter_context(closing(lazymap(executor, getnames, dicomfiles_)))
+        else:
+            names    = map(getnames, dicomfiles_)
+
+        # Sort the dicomfiles in (e.g. DICOM Series) subfolders
+        subfolders   = {}           # Cache of the subfolder pathnames
+        missingfiles = []           # The missing dicomfiles are reported in one go afterwards
+        for dicomfile, newnames in zip(dicomfiles, names):
 
-        # Check if the DICOM file exists (e.g. in case of DICOMDIRs this may not be the case)
-        if not dicomfile.is_file():
-            LOGGER.warning(f"Could not find the expected '{dicomfile}' DICOM file")
-            continue
+            if newnames is None:
+                missingfiles.append(dicomfile)
+                continue
+            subfolder, filename = newnames
 
-        # Create a new subfolder if needed
-        if not folderscheme:
-            pathname = sessionfolder
-        else:
-            subfolder = construct_name(folderscheme, dicomfile)
-            if not subfolder:
-                LOGGER.error('Cannot create subfolders, aborting dicomsort()...')
-                return
-            pathname = sessionfolder/subfolder
-            if subfolder not in subfolders:
-                subfolders.append(subfolder)
-                if not pathname.is_dir():
-                    LOGGER.info(f"   Creating:  {pathname}")
-                    if not dryrun:
-                        pathname.mkdir(parents=True)
-
-        # Move and/or rename the dicomfiles in(to) the (sub)folder
-        if namescheme:
-            newfilename = pathname/construct_name(namescheme, dicomfile)
-        else:
-            newfilename = pathname/dicomfile.name
-        if newfilename == dicomfile:
-            continue
-        if newfilename.is_file():
-            LOGGER.warning(f"File already exists: {dicomfile} -> {newfilename}")
-            newfilename = newfilename.with_name(newfilename.stem + str(uuid.uuid4()) + newfilename.suffix)
-            LOGGER.info(f"Using new file-name: {dicomfile} -> {newfilename}")
-        if not dryrun:
-            dicomfile.replace(newfilename)
+            # Create a new subfolder if needed
+            if not folderscheme:
+                pathname = sessionfolder
+            else:
+                if not subfolder:
+                    LOGGER.error('Cannot create subfolders, aborting dicomsort()...')
+                    break
+                pathname = subfolders.get(subfolder)
+                if pathname is None:
+                    pathname = subfolders[subfolder] = sessionfolder/subfolder
+                    if dryrun:
+                        if not pathname.is_dir():
+                            LOGGER.info(f"   Creating:  {pathname}")
+                    else:
+                        try:
+                            pathname.mkdir(parents=True)
+                            LOGGER.info(f"   Creating:  {pathname}")
+                        except FileExistsError:
+                            if not pathname.is_dir(): raise
+
+            # Move and/or rename the dicomfiles in(to) the (sub)folder
+            newfilename = pathname/filename
+            if newfilename == dicomfile:
+                continue
+            if newfilename.is_file():
+                LOGGER.warning(f"File already exists: {dicomfile} -> {newfilename}")
+                stem, ext   = os.path.splitext(filename)
+                newfilename = pathname/f"{stem}{uuid.uuid4()}{ext}"
+                LOGGER.info(f"Using new file-name: {dicomfile} -> {newfilename}")
+            if not dryrun:
+                movefile(dicomfile, newfilename, dirfds)
+
+    if missingfiles:
+        LOGGER.warning(f"Could not find {len(missingfiles)} expected DICOM file(s), e.g. '{missingfiles[0]}'")
+        LOGGER.debug(f"Missing DICOM files: {[str(missingfile) for missingfile in missingfiles]}")
+
+
+def lsdicomfiles(folder: Path, pattern: re.Pattern, recursive: bool) -> List[Path]:
+    """
+    Gets all files in a folder that match the regular expression pattern. Uses os.scandir() to avoid a stat() call per file.
+    As with Path.rglob(), (sub)folders that cannot be read are skipped
+
+    :param folder:      The full pathname of the folder
+    :param pattern:     The compiled regular expression pattern used in pattern.match(dicomfile) to select the dicom files
+    :param recursive:   Boolean to search for dicom files recursively in the subfolders (symbolic links to folders are not followed)
+    :return:            A list with all matching files in the folder
+    """
+
+    dicomfiles = []
+    try:
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    if pattern.match(entry.path):
+                        dicomfiles.append(folder/entry.name)
+                elif recursive and entry.is_dir(follow_symlinks=False):
+                    dicomfiles += lsdicomfiles(folder/entry.name, pattern, recursive)
+    except PermissionError as permissionerror:
+        LOGGER.debug(f"Skipping unreadable folder: {permissionerror}")
+
+    return dicomfiles
+
+
+def lssubdirs(folder: Path, prefix: str) -> List[Path]:
+    """
+    Gets all subfolders in a folder that start with prefix. Uses os.scandir() and a plain string comparison instead of
+    globbing, unless the prefix contains (glob.glob) shell-style wildcards itself. As with globbing, the comparison is
+    case-insensitive on Windows and folders that cannot be read yield no subfolders
+
+    :param folder:  The full pathname of the folder
+    :param prefix:  The prefix of the subfolder names. Foldernames starting with a dot are considered hidden and will be skipped
+    :return:        A sorted list with all matching subfolders in the folder
+    """
+
+    if glob.has_magic(prefix):
+        return bidscoin.lsdirs(folder, prefix + '*')
+
+    prefix = os.path.normcase(prefix)
+    try:
+        with os.scandir(folder) as entries:
+            return sorted(folder/entry.name for entry in entries if os.path.normcase(entry.name).startswith(prefix) and not entry.name.startswith('.') and entry.is_dir())
+    except PermissionError as permissionerror:
+        LOGGER.debug(f"Skipping unreadable folder: {permissionerror}")
+        return []
 
 
 def sortsessions(sourcefolder: Path, subprefix: str='', sesprefix: str='', folderscheme: str='{SeriesNumber:03d}-{SeriesDescription}',
-                 namescheme: str='', pattern: str='.*\.(IMA|dcm)$', recursive: bool=True, dryrun: bool=False) -> List[Path]:
+                 namescheme: str='', pattern: Union[str, re.Pattern]=PATTERN, recursive: bool=True, dryrun: bool=False) -> List[Path]:
     """
     Wrapper around sortsession() to loop over subjects and sessions and map the session DICOM files
 
@@ -144,7 +476,7 @@ def sortsessions(sourcefolder: Path, subprefix: str='', sesprefix: str='', folde
     :param sesprefix:    The prefix for searching the ses folders in sub folder
     :param folderscheme: Optional naming scheme for the sorted (e.g. Series) subfolders. Follows the Python string formatting syntax with DICOM field names in curly bracers with an optional number of digits for numeric fields', default='{SeriesNumber:03d}-{SeriesDescription}'
     :param namescheme:   Optional naming scheme for renaming the files. Follows the Python string formatting syntax with DICOM field names in curly bracers, e.g. {PatientName}_{SeriesNumber:03d}_{SeriesDescription}_{AcquisitionNumber:05d}_{InstanceNumber:05d}.IMA
-    :param pattern:      The regular expression pattern used in re.match() to select the dicom files
+    :param pattern:      The (compiled) regular expression pattern used in re.match() to select the dicom files
     :param recursive:    Boolean to search for DICOM files recursively in a session folder
     :param dryrun:       Boolean to just display the action
     :return:             List of sorted sessions
@@ -163,6 +495,7 @@ def sortsessions(sourcefolder: Path, subprefix: str='', sesprefix: str='', folde
         return []
     if not subprefix: subprefix = ''
     if not sesprefix: sesprefix = ''
+    pattern = re.compile(pattern)       # NB: This is a no-op for already compiled patterns
 
     # Use the DICOMDIR file if it is there
     sessions = []       # Collect the sorted session-folders
@@ -170,29 +503,29 @@ def sortsessions(sourcefolder: Path, subprefix: str='', sesprefix: str='', folde
         dicomdir = pydicom.dcmread(str(sourcefolder/'DICOMDIR'))
         for patient in dicomdir.patient_records:
             for n, study in enumerate(patient.children, 1):
-                dicomfiles = [sourcefolder.joinpath(*image.ReferencedFileID) for series in study.children for image in series.children]
-                if dicomfiles:
+                if any(series.children for series in study.children):
+                    dicomfiles    = (sourcefolder.joinpath(*image.ReferencedFileID) for series in study.children for image in series.children)
                     sessionfolder = sourcefolder/f"{subprefix}{cleanup(patient.PatientName)}"/f"{sesprefix}{n:02}-{cleanup(study.StudyDescription)}"
                     sortsession(sessionfolder, dicomfiles, folderscheme, namescheme, dryrun)
                     sessions.append(sessionfolder)
 
     # Do a recursive call if a sub- or ses-prefix is given
     elif subprefix or sesprefix:
-        for subjectfolder in bidscoin.lsdirs(sourcefolder, subprefix + '*'):
-            if sesprefix:
-                sessionfolders = bidscoin.lsdirs(subjectfolder, sesprefix + '*')
+        sessionfolders = lssubdirs(sourcefolder, subprefix)
+        if sesprefix:
+            lssessions = partial(lssubdirs, prefix=sesprefix)
+            if len(sessionfolders) > 1:     # List the session folders of all subjects concurrently to hide the (network) filesystem latencies
+                with ThreadPoolExecutor(THREADS) as executor:
+                    sessionfolders = list(chain.from_iterable(executor.map(lssessions, sessionfolders)))
             else:
-                sessionfolders = [subjectfolder]
-            for sessionfolder in sessionfolders:
-                sessions += sortsessions(sessionfolder, folderscheme=folderscheme, namescheme=namescheme, pattern=pattern, recursive=recursive, dryrun=dryrun)
+                sessionfolders = list(chain.from_iterable(map(lssessions, sessionfolders)))
+        for sessionfolder in sessionfolders:
+            sessions += sortsessions(sessionfolder, folderscheme=folderscheme, namescheme=namescheme, pattern=pattern, recursive=recursive, dryrun=dryrun)
 
     # Sort the DICOM files in the sourcefolder
     else:
-        sessions = [sourcefolder]
-        if recursive:
-            dicomfiles = [dcmfile for dcmfile in sourcefolder.rglob('*') if dcmfile.is_file() and re.match(pattern, str(dcmfile))]
-        else:
-            dicomfiles = [dcmfile for dcmfile in sourcefolder.iterdir()  if dcmfile.is_file() and re.match(pattern, str(dcmfile))]
+        sessions   = [sourcefolder]
+        dicomfiles = lsdicomfiles(sourcefolder, pattern, recursive)
         if dicomfiles:
             sortsession(sourcefolder, dicomfiles, folderscheme, namescheme, dryrun)
 
@@ -219,7 +552,7 @@ def main():
     parser.add_argument('-j','--sesprefix',     help='Provide a prefix string for recursive sorting of dicomsource/subject/session subfolders (e.g. "ses-")')
     parser.add_argument('-f','--folderscheme',  help='Naming scheme for the sorted DICOM Series subfolders. Follows the Python string formatting syntax with DICOM field names in curly bracers with an optional number of digits for numeric fields. Sorting in subfolders is skipped when an empty folderscheme is given (but note that renaming the filenames can still be performed)', default='{SeriesNumber:03d}-{SeriesDescription}')
     parser.add_argument('-n','--namescheme',    help='Optional naming scheme that can be provided to rename the DICOM files. Follows the Python string formatting syntax with DICOM field names in curly bracers with an optional number of digits for numeric fields. Use e.g. "{PatientName}_{SeriesNumber:03d}_{SeriesDescription}_{AcquisitionNumber:05d}_{InstanceNumber:05d}.dcm" or "{InstanceNumber:05d}_{SOPInstanceUID}.IMA" for default names')
-    parser.add_argument('-p','--pattern',       help='The regular expression pattern used in re.match(pattern, dicomfile) to select the dicom files', default='.*\.(IMA|dcm)$')
+    parser.add_argument('-p','--pattern',       help='The regular expression pattern used in re.match(pattern, dicomfile) to select the dicom files', default=r'.*\.(IMA|dcm)$')
     parser.add_argument('-d','--dryrun',        help='Add this flag to just print the dicomsort commands without actually doing anything', action='store_true')
     args = parser.parse_args()
 
@@ -0,0 +1,182 @@
+import unittest
+import os
+import shutil
+import tempfile
+import importlib.util
+import multiprocessing
+import errno
+import pydicom
+from pydicom import fileset
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from pathlib import Path
+from unittest import mock
+from pydicom.data import get_testdata_file
+from pydicom.uid import generate_uid
+
+from bidscoin import dicomsort
+try:
+    import resource
+except ImportError:
+    resource = None     # E.g. on Windows
+
+SERIES = {1: 'T1/MPRAGE', 2: 'rest?', 3: 'dwi'}
+
+
+def make_session(sessionfolder: Path, nfiles: int, seriesnumber: bool=True):
+    """Creates nfiles DICOM files in the sessionfolder (cycling through the SERIES) from a pydicom test file"""
+
+    sessionfolder.mkdir(parents=True, exist_ok=True)
+    dicomdata = pydicom.dcmread(get_testdata_file('MR_small.dcm'))
+    for n in range(nfiles):
+        seriesnr = n % len(SERIES) + 1
+        dicomdata.SOPInstanceUID    = dicomdata.file_meta.MediaStorageSOPInstanceUID = generate_uid()
+        dicomdata.SeriesInstanceUID = f"{dicomdata.StudyInstanceUID}.{seriesnr}"
+        dicomdata.SeriesDescription = SERIES[seriesnr]
+        dicomdata.StudyDescription  = 'Study'
+        dicomdata.InstanceNumber    = n
+        if seriesnumber:
+            dicomdata.SeriesNumber = seriesnr
+        elif 'SeriesNumber' in dicomdata:
+            del dicomdata.SeriesNumber
+        dicomdata.save_as(sessionfolder/f"{n:04d}.IMA")
+
+
+def expected_tree(nfiles: int) -> set:
+    """The expected relative pathnames of the sorted and renamed DICOM files"""
+
+    return {f"{seriesnr:03d}-{dicomsort.cleanup(SERIES[seriesnr])}/{seriesnr:03d}_{n:05d}.dcm"
+            for n, seriesnr in ((n, n % len(SERIES) + 1) for n in range(nfiles))}
+
+
+def tree(folder: Path) -> set:
+    return {path.relative_to(folder).as_posix() for path in folder.rglob('*') if path.is_file()}
+
+
+def unreadable(scandir, folder: Path):
+    """Wraps os.scandir() such that the folder raises a PermissionError, as if it cannot be read"""
+
+    def scandir_(path):
+        if Path(path) == folder:
+            raise PermissionError(errno.EACCES, os.strerror(errno.EACCES), str(path))
+        return scandir(path)
+
+    return scandir_
+
+
+class TestDicomsort(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = Path(tempfile.mkdtemp())
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_lazymap(self):
+        items = range(-5 * dicomsort.CHUNKSIZE, 5 * dicomsort.CHUNKSIZE + 7)
+        with ProcessPoolExecutor(2, initializer=dicomsort.initworker, initargs=(30,)) as executor:
+            self.assertEqual(list(dicomsort.lazymap(executor, abs, items)), [abs(item) for item in items])
+
+    def test_construct_names_spawn(self):
+        """Spawned worker processes do not run bidscoin.setup_logging(), yet bids.get_dicomfield() uses the custom log levels, e.g. for hidden files"""
+        make_session(self.tmpdir, 1, seriesnumber=False)
+        hiddenfile = (self.tmpdir/'0000.IMA').rename(self.tmpdir/'._0000.dcm')
+        folderscheme = '{SeriesNumber:03d}-{SeriesDescription}'
+        getnames     = partial(dicomsort.construct_names, folderscheme=folderscheme, namescheme='', tags=dicomsort.schemetags(dicomsort.schemefields(folderscheme)))
+        with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn'), initializer=dicomsort.initworker, initargs=(30,)) as executor:
+            self.assertEqual(list(dicomsort.lazymap(executor, getnames, [hiddenfile])), [('', hiddenfile.name)])
+
+    def test_lsdicomfiles(self):
+        for name in ('a.IMA', 'b.dcm', 'c.txt', 'sub/d.IMA', 'sub/sub/e.dcm'):
+            (self.tmpdir/name).parent.mkdir(parents=True, exist_ok=True)
+            (self.tmpdir/name).touch()
+        self.assertEqual({path.relative_to(self.tmpdir).as_posix() for path in dicomsort.lsdicomfiles(self.tmpdir, dicomsort.PATTERN, False)},
+                         {'a.IMA', 'b.dcm'})
+        self.assertEqual({path.relative_to(self.tmpdir).as_posix() for path in dicomsort.lsdicomfiles(self.tmpdir, dicomsort.PATTERN, True)},
+                         {'a.IMA', 'b.dcm', 'sub/d.IMA', 'sub/sub/e.dcm'})
+
+    def test_lsdicomfiles_unreadable(self):
+        for name in ('a.IMA', 'sub/b.IMA', 'unreadable/c.IMA'):
+            (self.tmpdir/name).parent.mkdir(parents=True, exist_ok=True)
+            (self.tmpdir/name).touch()
+        with mock.patch('os.scandir', side_effect=unreadable(os.scandir, self.tmpdir/'unreadable')):
+            self.assertEqual({path.relative_to(self.tmpdir).as_posix() for path in dicomsort.lsdicomfiles(self.tmpdir, dicomsort.PATTERN, True)},
+                             {'a.IMA', 'sub/b.IMA'})
+
+    def test_lssubdirs(self):
+        for name in ('sub-02', 'sub-01', 'sub-03.txt', 'ses-01', '.sub-04'):
+            (self.tmpdir/name).mkdir()
+        (self.tmpdir/'sub-03.txt').rmdir()
+        (self.tmpdir/'sub-03.txt').touch()
+        self.assertEqual(dicomsort.lssubdirs(self.tmpdir, 'sub-'), [self.tmpdir/'sub-01', self.tmpdir/'sub-02'])
+        self.assertEqual(dicomsort.lssubdirs(self.tmpdir, 'sub-*2'), [self.tmpdir/'sub-02'])
+
+    def test_lssubdirs_unreadable(self):
+        for name in ('sub-01', 'sub-02/ses-01', 'sub-02/ses-02'):
+            (self.tmpdir/name).mkdir(parents=True)
+        with mock.patch('os.scandir', side_effect=unreadable(os.scandir, self.tmpdir/'sub-01')):
+            self.assertEqual(dicomsort.lssubdirs(self.tmpdir/'sub-01', 'ses-'), [])
+            self.assertEqual(dicomsort.lssubdirs(self.tmpdir/'sub-02', 'ses-'), [self.tmpdir/'sub-02'/'ses-01', self.tmpdir/'sub-02'/'ses-02'])
+            self.assertEqual(set(dicomsort.sortsessions(self.tmpdir, subprefix='sub-', sesprefix='ses-')), {self.tmpdir/'sub-02'/'ses-01', self.tmpdir/'sub-02'/'ses-02'})
+
+    def test_read_dicomfields(self):
+        make_session(self.tmpdir, 1)
+        tags      = dicomsort.schemetags(dicomsort.schemefields('{SeriesNumber:03d}-{SeriesDescription}'))
+        dicomdata = dicomsort.read_dicomfields(self.tmpdir/'0000.IMA', tags)
+        self.assertEqual(dicomdata.SeriesNumber, 1)
+        self.assertEqual(dicomdata.SeriesDescription, SERIES[1])
+        self.assertNotIn('InstanceNumber', dicomdata)
+        self.assertNotIn('PixelData', dicomdata)
+        self.assertIsNone(dicomsort.read_dicomfields(self.tmpdir/'nonexisting.IMA', tags))
+
+    def test_sortsessions(self):
+        nfiles  = 2 * dicomsort.CHUNKSIZE + 5                   # Use the pool of worker processes
+        session = self.tmpdir/'sub-01'/'ses-01'
+        make_session(session, nfiles)
+        sessions = dicomsort.sortsessions(self.tmpdir, subprefix='sub-', sesprefix='ses-', namescheme='{SeriesNumber:03d}_{InstanceNumber:05d}.dcm')
+        self.assertEqual(sessions, [session])
+        self.assertEqual(tree(session), expected_tree(nfiles))
+
+    def test_sortsessions_abort(self):
+        nfiles = 2 * dicomsort.CHUNKSIZE + 5
+        make_session(self.tmpdir, nfiles, seriesnumber=False)
+        with self.assertLogs('bidscoin.dicomsort', 'WARNING') as logs:
+            dicomsort.sortsessions(self.tmpdir)
+        self.assertEqual(len([record for record in logs.records if record.levelname == 'WARNING']), 1)
+        self.assertEqual(len([record for record in logs.records if record.levelname == 'ERROR']), 1)
+        self.assertEqual(tree(self.tmpdir), {f"{n:04d}.IMA" for n in range(nfiles)})
+
+    @unittest.skipUnless(resource and dicomsort.DIRFDS, 'Folder descriptors or RLIMIT_NOFILE are not supported on this platform')
+    def test_sortsessions_rlimit(self):
+        """Sorts more input and series folders than there are file descriptors available"""
+        nfolders = 200
+        dicomdata = pydicom.dcmread(get_testdata_file('MR_small.dcm'))
+        for n in range(nfolders):
+            dicomdata.SeriesNumber      = n + 1
+            dicomdata.SeriesDescription = 'series'
+            os.mkdir(self.tmpdir/f"in{n:03d}")
+            dicomdata.save_as(self.tmpdir/f"in{n:03d}"/'dicomfile.IMA')
+        softlimit, hardlimit = resource.getrlimit(resource.RLIMIT_NOFILE)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (128, hardlimit))
+        try:
+            dicomsort.sortsessions(self.tmpdir)
+        finally:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (softlimit, hardlimit))
+        self.assertEqual(tree(self.tmpdir), {f"{n + 1:03d}-series/dicomfile.IMA" for n in range(nfolders)})
+
+    @unittest.skipIf(importlib.util.find_spec('pydicom.dicomdir') is None, 'The DICOMDIR patient_records are not supported by pydicom >= 3')
+    def test_sortsessions_dicomdir(self):
+        nfiles = 2 * dicomsort.CHUNKSIZE + 5
+        make_session(self.tmpdir/'raw', nfiles)
+        dicomdir = fileset.FileSet()
+        for dicomfile in sorted((self.tmpdir/'raw').iterdir()):
+            dicomdir.add(dicomfile)
+        dicomdir.write(self.tmpdir/'dicomdir')
+        sessions = dicomsort.sortsessions(self.tmpdir/'dicomdir'/'DICOMDIR', subprefix='sub-', sesprefix='ses-', namescheme='{SeriesNumber:03d}_{InstanceNumber:05d}.dcm')
+        session  = self.tmpdir/'dicomdir'/'sub-CompressedSamples^MR1'/'ses-01-Study'
+        self.assertEqual(sessions, [session])
+        self.assertEqual(tree(session), expected_tree(nfiles))
+
+
+if __name__ == '__main__':
+    unittest.main()